@@ -1,16 +1,56 @@
 from flask import Flask, request, jsonify
-from flask_cors import CORS
+from flask.json.provider import JSONProvider
+from werkzeug.exceptions import HTTPException
 import sys
 import os
-import json
+import re
+from dataclasses import dataclass, asdict
 from datetime import datetime
+from typing import Any, Dict, List
+import orjson
 
 # Import the model wrapper and PII dependency handler
 from model_wrapper import get_model_wrapper
 from pii_dependency_handler import PIIDependencyHandler
+from redis_client import R
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for jsonify() and request.get_json()"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the str round-trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype='application/json')
 
 app = Flask(__name__)
-CORS(app)
+app.json = OrjsonProvider(app)
+# Cap request bodies (a full batch of chat messages fits easily); larger ones get a 413
+app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+
+@app.after_request
+def _add_cors_headers(response):
+    """Public API with a single wildcard origin, so the headers are static"""
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET,POST,DELETE,OPTIONS'
+    return response
+
+@app.errorhandler(Exception)
+def _jsonify_error(e):
+    """Return unhandled errors as JSON instead of Flask's HTML error page"""
+    if not isinstance(e, HTTPException):
+        return jsonify({'error': str(e)}), 500
+    # Keep the exception's own status and headers (Allow, Location, ...) and swap only the body
+    response = e.get_response()
+    response.data = orjson.dumps({'error': str(e)})
+    response.content_type = 'application/json'
+    return response
 
 # Initialize the model wrapper and PII dependency handler
 model_wrapper = get_model_wrapper()
@@ -18,9 +58,59 @@ pii_handler = PIIDependencyHandler()
 print(f"[INFO] Model Status: {model_wrapper.get_status()}")
 print(f"[INFO] PII Dependency Handler initialized")
 
-# In-memory storage for sessions (in production, use a database)
-sessions = {}
-messages = {}
+# Simple PII detection patterns used by the fallback path
+_EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b')
+_PHONE_RE = re.compile(r'\b\d{3}-\d{3}-\d{4}\b')
+_SSN_RE = re.compile(r'\b\d{3}-\d{2}-\d{4}\b')
+_CC_RE = re.compile(r'\b\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\b')
+_PII_PATTERNS = [
+    ('email', _EMAIL_RE),
+    ('phone', _PHONE_RE),
+    ('ssn', _SSN_RE),
+    ('credit_card', _CC_RE),
+]
+# All four patterns fused into one alternation, dispatched on the named group
+_PII_UNION_RE = re.compile('|'.join(f'(?P<{name}>{pattern.pattern})' for name, pattern in _PII_PATTERNS))
+
+# Sessions live in Redis hashes (sess:<id>) and messages in Redis lists
+# (msgs:<id>) so every gunicorn worker sees the same state. Message ids come
+# from a per-session counter (msgseq:<id>) so concurrent posts never collide
+
+# Upper bound on texts accepted by the batch messages endpoint
+MAX_BATCH_SIZE = 50
+
+# Sessions and their messages expire after a day without activity
+SESSION_TTL = 86400
+
+@dataclass(slots=True)
+class Session:
+    """Chat session record, stored as a Redis hash"""
+    id: str
+    title: str
+    created_at: str
+    updated_at: str
+
+@dataclass(slots=True)
+class Message:
+    """Processed chat message, stored as JSON in the session's Redis list"""
+    id: str
+    user_message: str
+    anonymized_text: str
+    llm_prompt: str
+    llm_response_raw: str
+    llm_response_reconstructed: str
+    bot_response: str
+    reconstructed_text: str
+    privacy_score: float
+    processing_time: float
+    timestamp: str
+    detected_entities: List[Any]
+    entities_masked: List[Any]
+    entities_preserved: List[Any]
+    context: str
+    privacy_preserved: bool
+    replacements: Dict[str, Any]
+    original_pii_map: Dict[str, Any]
 
 @app.route('/', methods=['GET'])
 def index():
@@ -50,196 +140,277 @@ def health_check():
 @app.route('/api/sessions', methods=['POST'])
 def create_session():
     """Create a new chat session"""
-    try:
-        data = request.get_json() or {}
-        session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{len(sessions)}"
-        
-        session = {
-            'id': session_id,
-            'title': data.get('title', 'New Chat'),
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
-        }
-        
-        sessions[session_id] = session
-        messages[session_id] = []
-        
-        return jsonify(session), 201
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    data = request.get_json() or {}
+    now = datetime.now()
+    now_iso = now.isoformat()
+    session_id = f"session_{now.strftime('%Y%m%d_%H%M%S')}_{R.incr('session_seq')}"
+    
+    session = Session(
+        id=session_id,
+        title=data.get('title', 'New Chat'),
+        created_at=now_iso,
+        updated_at=now_iso
+    )
+    
+    pipe = R.pipeline(transaction=False)
+    pipe.hset(f"sess:{session_id}", mapping=asdict(session))
+    pipe.expire(f"sess:{session_id}", SESSION_TTL)
+    pipe.execute()
+    
+    return jsonify(session), 201
 
 @app.route('/api/sessions', methods=['GET'])
 def get_sessions():
     """Get all chat sessions"""
-    try:
-        return jsonify(list(sessions.values()))
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    pipe = R.pipeline(transaction=False)
+    for key in R.scan_iter('sess:*'):
+        pipe.hgetall(key)
+    return jsonify([session for session in pipe.execute() if session])
 
 @app.route('/api/sessions/<session_id>', methods=['DELETE'])
 def delete_session(session_id):
     """Delete a chat session"""
-    try:
-        if session_id in sessions:
-            del sessions[session_id]
-            if session_id in messages:
-                del messages[session_id]
-            return jsonify({'message': 'Session deleted successfully'})
-        else:
-            return jsonify({'error': 'Session not found'}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    if R.delete(f"sess:{session_id}", f"msgs:{session_id}", f"msgseq:{session_id}"):
+        return jsonify({'message': 'Session deleted successfully'})
+    else:
+        return jsonify({'error': 'Session not found'}), 404
 
 @app.route('/api/sessions/<session_id>/messages', methods=['GET', 'POST'])
 def handle_messages(session_id):
     """Handle messages in a session"""
-    try:
-        # Auto-create session if it doesn't exist
-        if session_id not in sessions:
-            sessions[session_id] = {
-                'id': session_id,
-                'title': 'Auto-created Chat',
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat()
-            }
-            messages[session_id] = []
-        
-        # Handle GET request
-        if request.method == 'GET':
-            return jsonify(messages.get(session_id, []))
-        
-        # Handle POST request
-        data = request.get_json()
-        if not data or 'text' not in data:
-            return jsonify({'error': 'Text is required'}), 400
-        
-        user_text = data['text']
-        start_time = datetime.now()
-        
-        # Check if PII analysis is provided from frontend
-        pii_analysis = data.get('pii_analysis')
-        
-        # Process with PII dependency handler
-        if pii_analysis:
-            result = pii_handler.process_query(user_text, pii_analysis)
-        else:
-            result = pii_handler.process_query(user_text)
-        
-        message = {
-            'id': f"msg_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{len(messages.get(session_id, []))}",
-            'user_message': user_text,
-            'anonymized_text': result.get('masked_query', user_text),
-            'llm_prompt': result.get('masked_query', user_text),
-            'llm_response_raw': result.get('llm_response', 'No response'),
-            'llm_response_reconstructed': result.get('final_response', 'No response'),
-            'bot_response': result.get('llm_response', 'No response'),
-            'reconstructed_text': result.get('final_response', 'No response'),
-            'privacy_score': _calculate_privacy_score(result),
-            'processing_time': (datetime.now() - start_time).total_seconds(),
-            'timestamp': datetime.now().isoformat(),
-            'detected_entities': result.get('detected_entities', []),
-            'entities_masked': result.get('entities_masked', []),
-            'entities_preserved': result.get('entities_preserved', []),
-            'context': result.get('context', 'General'),
-            'privacy_preserved': result.get('privacy_preserved', False),
-            'replacements': result.get('replacements', {}),
-            'original_pii_map': result.get('original_pii_map', {})
-        }
-        
-        # Store message
-        if session_id not in messages:
-            messages[session_id] = []
-        messages[session_id].append(message)
-        
-        # Update session timestamp
-        sessions[session_id]['updated_at'] = datetime.now().isoformat()
-        
-        return jsonify(message)
+    session_key = f"sess:{session_id}"
+    messages_key = f"msgs:{session_id}"
     
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    # Auto-create session if it doesn't exist
+    _ensure_session(session_id)
+    
+    # Handle GET request
+    if request.method == 'GET':
+        # Messages are already stored as JSON; splice them into an array as-is
+        stored = R.lrange(messages_key, 0, -1)
+        return app.response_class('[' + ','.join(stored) + ']', mimetype='application/json')
+    
+    # Handle POST request
+    data = request.get_json()
+    if not data or 'text' not in data:
+        return jsonify({'error': 'Text is required'}), 400
+    
+    user_text = data['text']
+    start_time = datetime.now()
+    start_tag = start_time.strftime('%Y%m%d_%H%M%S')
+    
+    # Check if PII analysis is provided from frontend
+    pii_analysis = data.get('pii_analysis')
+    
+    # Process with PII dependency handler
+    if pii_analysis:
+        result = pii_handler.process_query(user_text, pii_analysis)
+    else:
+        result = pii_handler.process_query(user_text)
+    
+    end_time = datetime.now()
+    end_iso = end_time.isoformat()
+    message = _build_message(
+        user_text, result,
+        f"msg_{start_tag}_{_reserve_message_indexes(session_id, 1)}",
+        end_iso,
+        (end_time - start_time).total_seconds()
+    )
+    
+    # Store message and update session timestamp in one round-trip
+    _store_messages(session_key, messages_key, [message], end_iso)
+    
+    return jsonify(message)
+
+@app.route('/api/sessions/<session_id>/messages/batch', methods=['POST'])
+def handle_messages_batch(session_id):
+    """Process several messages in one request, returned in input order"""
+    session_key = f"sess:{session_id}"
+    messages_key = f"msgs:{session_id}"
+    
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    texts = data.get('texts')
+    if not isinstance(texts, list) or not texts:
+        return jsonify({'error': 'texts must be a non-empty list'}), 400
+    if len(texts) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} texts per batch'}), 400
+    if not all(isinstance(text, str) for text in texts):
+        return jsonify({'error': 'texts must contain only strings'}), 400
+    
+    pii_analyses = data.get('pii_analyses')
+    if pii_analyses is not None and (not isinstance(pii_analyses, list) or len(pii_analyses) != len(texts)):
+        return jsonify({'error': 'pii_analyses must match texts in length'}), 400
+    if pii_analyses is not None and not all(_is_valid_pii_analysis(analysis) for analysis in pii_analyses):
+        return jsonify({'error': 'pii_analyses entries must be null or objects with a string maskedQuery and lists of entity objects with string value/type'}), 400
+    
+    _ensure_session(session_id)
+    start_time = datetime.now()
+    start_tag = start_time.strftime('%Y%m%d_%H%M%S')
+    
+    results = pii_handler.process_queries(texts, pii_analyses)
+    
+    end_time = datetime.now()
+    end_iso = end_time.isoformat()
+    processing_time = (end_time - start_time).total_seconds()
+    first_index = _reserve_message_indexes(session_id, len(texts))
+    batch = [
+        _build_message(user_text, result, f"msg_{start_tag}_{first_index + i}", end_iso, processing_time)
+        for i, (user_text, result) in enumerate(zip(texts, results))
+    ]
+    
+    # Store all messages and update session timestamp in one round-trip
+    _store_messages(session_key, messages_key, batch, end_iso)
+    
+    return jsonify(batch)
 
 @app.route('/api/clear-history', methods=['POST'])
 def clear_history():
     """Clear all sessions and messages"""
-    try:
-        sessions.clear()
-        messages.clear()
-        return jsonify({'message': 'History cleared successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    R.flushdb()
+    return jsonify({'message': 'History cleared successfully'})
 
 @app.route('/api/test-pii', methods=['POST'])
 def test_pii():
     """Test PII processing endpoint"""
-    try:
-        data = request.get_json()
-        if not data or 'text' not in data:
-            return jsonify({'error': 'Text is required'}), 400
-        
-        user_text = data['text']
-        result = model_wrapper.process_query(user_text)
-        
-        return jsonify({
-            'original': result.get('original_query', user_text),
-            'masked': result.get('masked_query', user_text),
-            'detected': result.get('detected_entities', []),
-            'masked_entities': result.get('entities_masked', []),
-            'preserved': result.get('entities_preserved', []),
-            'replacements': result.get('replacements', {}),
-            'response': result.get('final_response', 'No response'),
-            'model_type': model_wrapper.get_status()['model_type']
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    data = request.get_json()
+    if not data or 'text' not in data:
+        return jsonify({'error': 'Text is required'}), 400
+    
+    user_text = data['text']
+    result = model_wrapper.process_query(user_text)
+    
+    return jsonify({
+        'original': result.get('original_query', user_text),
+        'masked': result.get('masked_query', user_text),
+        'detected': result.get('detected_entities', []),
+        'masked_entities': result.get('entities_masked', []),
+        'preserved': result.get('entities_preserved', []),
+        'replacements': result.get('replacements', {}),
+        'response': result.get('final_response', 'No response'),
+        'model_type': model_wrapper.get_status()['model_type']
+    })
+
+def _ensure_session(session_id):
+    """Auto-create a session record if it doesn't exist yet"""
+    session_key = f"sess:{session_id}"
+    if not R.exists(session_key):
+        now_iso = datetime.now().isoformat()
+        pipe = R.pipeline(transaction=False)
+        pipe.hset(session_key, mapping=asdict(Session(
+            id=session_id,
+            title='Auto-created Chat',
+            created_at=now_iso,
+            updated_at=now_iso
+        )))
+        pipe.expire(session_key, SESSION_TTL)
+        pipe.execute()
+
+def _is_valid_pii_analysis(analysis):
+    """Check a frontend PII analysis has the shape PIIDependencyHandler reads"""
+    if analysis is None:
+        return True
+    if not isinstance(analysis, dict):
+        return False
+    if not isinstance(analysis.get('maskedQuery', ''), str):
+        return False
+    for field in ('dependentEntities', 'nonDependentEntities', 'allEntities'):
+        entities = analysis.get(field, [])
+        if not isinstance(entities, list):
+            return False
+        for entity in entities:
+            if not isinstance(entity, dict):
+                return False
+            if not isinstance(entity.get('value', ''), str) or not isinstance(entity.get('type', ''), str):
+                return False
+    return True
+
+def _reserve_message_indexes(session_id, count):
+    """Atomically reserve count message indexes for a session, returning the first"""
+    seq_key = f"msgseq:{session_id}"
+    pipe = R.pipeline(transaction=False)
+    pipe.incrby(seq_key, count)
+    pipe.expire(seq_key, SESSION_TTL)
+    last_index, _ = pipe.execute()
+    return last_index - count
+
+def _store_messages(session_key, messages_key, new_messages, updated_at):
+    """Append messages, bump the session timestamp and refresh TTLs in one pipeline"""
+    pipe = R.pipeline(transaction=False)
+    pipe.rpush(messages_key, *[orjson.dumps(message) for message in new_messages])
+    pipe.hset(session_key, 'updated_at', updated_at)
+    pipe.expire(session_key, SESSION_TTL)
+    pipe.expire(messages_key, SESSION_TTL)
+    pipe.execute()
+
+def _build_message(user_text, result, message_id, timestamp, processing_time):
+    """Assemble the stored/returned message from a PII handler result"""
+    masked_query = result.get('masked_query', user_text)
+    llm_response = result.get('llm_response', 'No response')
+    final_response = result.get('final_response', 'No response')
+    return Message(
+        id=message_id,
+        user_message=user_text,
+        anonymized_text=masked_query,
+        llm_prompt=masked_query,
+        llm_response_raw=llm_response,
+        llm_response_reconstructed=final_response,
+        bot_response=llm_response,
+        reconstructed_text=final_response,
+        privacy_score=_calculate_privacy_score(result),
+        processing_time=processing_time,
+        timestamp=timestamp,
+        detected_entities=result.get('detected_entities', []),
+        entities_masked=result.get('entities_masked', []),
+        entities_preserved=result.get('entities_preserved', []),
+        context=result.get('context', 'General'),
+        privacy_preserved=result.get('privacy_preserved', False),
+        replacements=result.get('replacements', {}),
+        original_pii_map=result.get('original_pii_map', {})
+    )
 
 def _calculate_privacy_score(result):
     """Calculate privacy score based on processing result"""
     if not result:
         return 50.0
     
-    detected_count = len(result.get('detected_entities', []))
-    masked_count = len(result.get('entities_masked', []))
-    
+    # PIIDependencyHandler precomputes the counts; other results are counted here
+    detected_count, masked_count = result.get('_counts') or (
+        len(result.get('detected_entities', ())), len(result.get('entities_masked', ()))
+    )
     if detected_count == 0:
         return 100.0
     
-    # Higher score for more entities masked
-    masking_ratio = masked_count / detected_count if detected_count > 0 else 1.0
-    base_score = 100.0 - (detected_count * 8)  # Reduce score for detected PII
-    privacy_bonus = masking_ratio * 15  # Bonus for masking
-    
-    return max(20.0, min(100.0, base_score + privacy_bonus))
+    # -8 per detected entity, plus up to +15 scaled by the share that was masked
+    return max(20.0, min(100.0, 100.0 - detected_count * 8 + masked_count * 15.0 / detected_count))
 
-def _create_fallback_message(user_text, start_time):
+def _create_fallback_message(user_text, start_time, message_index=0):
     """Create a fallback message when privacy handler is not available"""
-    import re
-    
-    # Simple PII detection patterns
-    pii_patterns = {
-        'email': r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
-        'phone': r'\b\d{3}-\d{3}-\d{4}\b',
-        'ssn': r'\b\d{3}-\d{2}-\d{4}\b',
-        'credit_card': r'\b\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\b'
-    }
-    
     detected_entities = []
     anonymized_text = user_text
     
-    for entity_type, pattern in pii_patterns.items():
-        if re.search(pattern, user_text):
-            detected_entities.append(entity_type)
-            anonymized_text = re.sub(pattern, f'[{entity_type.upper()}]', anonymized_text)
+    # Every pattern needs a digit or an '@', so most chat text skips the scan entirely
+    if '@' in user_text or any(ch.isdigit() for ch in user_text):
+        found = set()
+        
+        def _mask(match):
+            found.add(match.lastgroup)
+            return f'[{match.lastgroup.upper()}]'
+        
+        anonymized_text = _PII_UNION_RE.sub(_mask, user_text)
+        detected_entities = [name for name, _ in _PII_PATTERNS if name in found]
     
+    now = datetime.now()
     return {
-        'id': f"msg_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{len(messages)}",
+        'id': f"msg_{now.strftime('%Y%m%d_%H%M%S')}_{message_index}",
         'user_message': user_text,
         'anonymized_text': anonymized_text,
         'bot_response': 'I understand your message. Your privacy is protected with basic anonymization.',
         'reconstructed_text': user_text,
         'privacy_score': 100.0 - (len(detected_entities) * 15),
-        'processing_time': (datetime.now() - start_time).total_seconds(),
-        'timestamp': datetime.now().isoformat(),
+        'processing_time': (now - start_time).total_seconds(),
+        'timestamp': now.isoformat(),
         'detected_entities': detected_entities,
         'entities_masked': detected_entities,
         'entities_preserved': [],
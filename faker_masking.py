@@ -1,6 +1,9 @@
 from faker import Faker
 import re
 
+_PHONE10 = re.compile(r'\b\d{10}\b')
+_EMAIL = re.compile(r'\b[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b')
+
 class FakerMasking:
     def __init__(self, seed=42):
         self.fake = Faker()
@@ -12,14 +15,14 @@ class FakerMasking:
         masked = text
         
         # Phone
-        for match in re.finditer(r'\b\d{10}\b', text):
-            fake_phone = ''.join([str(self.fake.random_digit()) for _ in range(10)])
+        for match in _PHONE10.finditer(text):
+            fake_phone = f"{self.fake.random.randint(0, 10**10 - 1):010d}"
             replacements[fake_phone] = match.group()
             masked = masked.replace(match.group(), fake_phone, 1)
             detected.append('phone')
         
         # Email
-        for match in re.finditer(r'\b[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b', text):
+        for match in _EMAIL.finditer(text):
             fake_email = self.fake.email()
             replacements[fake_email] = match.group()
             masked = masked.replace(match.group(), fake_email, 1)
@@ -28,7 +31,9 @@ class FakerMasking:
         return masked, replacements, detected
     
     def unmask_text(self, text, replacements):
-        result = text
-        for fake, original in replacements.items():
-            result = result.replace(fake, original)
-        return result
+        # Single pass over text; longest fakes first so overlapping keys match greedily
+        fakes = sorted((fake for fake in replacements if fake), key=len, reverse=True)
+        if not fakes:
+            return text
+        pattern = re.compile('|'.join(re.escape(fake) for fake in fakes))
+        return pattern.sub(lambda match: replacements[match.group(0)], text)
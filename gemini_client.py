@@ -0,0 +1,29 @@
+"""
+Shared Gemini HTTP client used by the model wrapper and the PII dependency handler
+"""
+
+import os
+import requests
+from requests.adapters import HTTPAdapter
+
+_API_BASE = 'https://generativelanguage.googleapis.com/v1beta/models'
+
+# The key travels in a header, not the query string, so it never appears in
+# the URLs that requests/urllib3 put into exception messages (and our logs)
+GEMINI_HEADERS = {
+    'Content-Type': 'application/json',
+    'x-goog-api-key': os.environ.get('GEMINI_API_KEY', '')
+}
+
+# One pooled keep-alive session per worker process, so every Gemini call reuses
+# an open TLS connection instead of handshaking from scratch. All calls go to
+# a single host, so one host pool is enough; maxsize bounds idle keep-alives
+GEMINI_SESSION = requests.Session()
+GEMINI_SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=50))
+
+# Set LLM_CACHE_DISABLED=1 to bypass every Gemini response cache
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_DISABLED', '').lower() not in ('1', 'true', 'yes')
+
+def gemini_url(model: str) -> str:
+    """generateContent endpoint for a model (no key in the URL, see GEMINI_HEADERS)"""
+    return f'{_API_BASE}/{model}:generateContent'
@@ -0,0 +1,35 @@
+"""
+Shared Redis connections used by the Flask backend: the data store for
+session/message storage and a separate cache for Gemini responses
+"""
+
+import os
+import redis
+
+# One connection pool per worker process (redis-py resets it after fork). Each
+# gevent worker runs up to 500 greenlets (--worker-connections) but holds at
+# most 64 sockets, so the pool blocks: a greenlet waits for a free connection
+# instead of failing with "Too many connections"
+pool = redis.BlockingConnectionPool(
+    host=os.environ.get('REDIS_HOST', 'localhost'),
+    port=int(os.environ.get('REDIS_PORT', 6379)),
+    db=int(os.environ.get('REDIS_DB', 0)),
+    max_connections=64,
+    timeout=10,
+    decode_responses=True
+)
+
+R = redis.Redis(connection_pool=pool)
+
+# The Gemini cache lives on its own instance (or at least its own database) so
+# that evicting cache entries can never touch sessions and messages
+cache_pool = redis.BlockingConnectionPool(
+    host=os.environ.get('REDIS_CACHE_HOST', os.environ.get('REDIS_HOST', 'localhost')),
+    port=int(os.environ.get('REDIS_CACHE_PORT', os.environ.get('REDIS_PORT', 6379))),
+    db=int(os.environ.get('REDIS_CACHE_DB', 1)),
+    max_connections=64,
+    timeout=10,
+    decode_responses=True
+)
+
+CACHE = redis.Redis(connection_pool=cache_pool)
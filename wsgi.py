@@ -1,3 +1,8 @@
+# Patch blocking stdlib I/O before anything imports requests/redis so the
+# Gemini and Redis calls yield to other greenlets under gunicorn -k gevent
+from gevent import monkey
+monkey.patch_all()
+
 from app import app
 
 if __name__ == "__main__":